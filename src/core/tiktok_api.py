@@ -2,7 +2,7 @@ import json
 import re
 
 from http_utils.http_client import HttpClient
-from utils.enums import StatusCode, TikTokError
+from utils.enums import StatusCode, TikTokError, TimeOut
 from utils.logger_manager import logger
 from utils.custom_exceptions import (
     UserLiveError,
@@ -10,6 +10,8 @@ from utils.custom_exceptions import (
     LiveNotFound,
 )
 
+STREAM_CHUNK_SIZE = 256 * 1024  # 256 KB
+
 
 class TikTokAPI:
     def __init__(self, proxy, cookies):
@@ -19,8 +21,20 @@ class TikTokAPI:
         self.EULER_API = "https://tiktok.eulerstream.com"
         self.TIKREC_API = "https://tikrec.com"
 
-        self.http_client = HttpClient(proxy, cookies).req
-        self._http_client_stream = HttpClient(proxy, cookies).req_stream
+        # Bytes read from the live stream per iteration
+        self.chunk_size = STREAM_CHUNK_SIZE
+
+        # A single client, so both sessions share the proxy check and
+        # keep their connections alive across calls
+        self._client = HttpClient(proxy, cookies)
+        self.http_client = self._client.req
+        self._http_client_stream = self._client.req_stream
+
+    def set_proxy(self, proxy) -> None:
+        """
+        Changes the proxy of the API session, keeping its connections and cookies.
+        """
+        self._client.set_proxy(proxy)
 
     def _is_authenticated(self) -> bool:
         response = self.http_client.get(f"{self.BASE_URL}/foryou")
@@ -267,7 +281,11 @@ class TikTokAPI:
 
     def download_live_stream(self, live_url: str):
         """Generator that returns the live stream for a given room_id."""
-        stream = self._http_client_stream.get(live_url, stream=True)
-        for chunk in stream.iter_content(chunk_size=4096):
-            if chunk:
-                yield chunk
+        with self._http_client_stream.get(
+            live_url, stream=True, timeout=TimeOut.STREAM_READ
+        ) as stream:
+            stream.raise_for_status()
+
+            for chunk in stream.iter_content(chunk_size=self.chunk_size):
+                if chunk:
+                    yield chunk
@@ -1,19 +1,68 @@
+import multiprocessing
 import os
+import random
+import signal
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import partial
 from http.client import HTTPException
-from multiprocessing import Process
 
 from requests import RequestException
 
 from core.tiktok_api import TikTokAPI
 from utils.logger_manager import logger
+from utils.stream_writer import StreamWriter
+from utils.ttl_cache import TTLCache
 from utils.video_management import VideoManagement
 from upload.telegram import Telegram
-from utils.custom_exceptions import LiveNotFound, UserLiveError, TikTokRecorderError
+from utils.custom_exceptions import (
+    LiveNotFound,
+    UserLiveError,
+    TikTokRecorderError,
+    StreamWriteError,
+)
 from utils.enums import Mode, Error, TimeOut, TikTokError
 
+MAX_PROBE_WORKERS = 8
+FOLLOWER_MAX_BACKOFF = 30  # minutes an offline follower can be skipped
+
+# Signals that stop the recorder gracefully, and the handler restored after one
+STOP_SIGNALS = {
+    signal.SIGINT: signal.default_int_handler,
+    signal.SIGTERM: signal.SIG_DFL,
+}
+
+
+def _ignore_sigint():
+    # CTRL + C stops the recorder, the uploads in progress are completed
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _upload_recording(output):
+    """
+    Uploads a finished recording, in the post-processing worker process.
+    """
+    Telegram().upload(output)
+
+
+def _log_upload_error(output, future):
+    """
+    Logs the error of a failed upload, which would otherwise be lost
+    in the worker process.
+    """
+    if future.cancelled():
+        return
+
+    ex = future.exception()
+    if ex is not None:
+        logger.error("Error while uploading %s: %r", output, ex)
+
 
 class TikTokRecorder:
+    # Message of the retry loops, formatted by the logger only when emitted
+    _MSG_RECHECK = "Waiting %s minutes before recheck\n"
+
     def __init__(
         self,
         url,
@@ -29,6 +78,10 @@ class TikTokRecorder:
     ):
         # Setup TikTok API client
         self.tiktok = TikTokAPI(proxy=proxy, cookies=cookies)
+        self._alive_cache = TTLCache()
+
+        # Set on CTRL + C or SIGTERM to stop waiting and recording
+        self._stop = threading.Event()
 
         # TikTok Data
         self.url = url
@@ -39,11 +92,16 @@ class TikTokRecorder:
         self.mode = mode
         self.automatic_interval = automatic_interval
         self.duration = duration
-        self.output = output
+        # Normalize the output directory once, with a trailing separator
+        self.output = os.path.join(output, "") if output else ""
 
         # Upload Settings
         self.use_telegram = use_telegram
 
+        # Worker process running uploads, created on first use
+        self._post_exec = None
+        self._post_exec_lock = threading.Lock()
+
         # Check if the user's country is blacklisted
         self.check_country_blacklisted()
 
@@ -53,6 +111,11 @@ class TikTokRecorder:
             if self.sec_uid is None:
                 raise TikTokRecorderError("Failed to retrieve sec_uid.")
 
+            # follower -> monotonic time before which it is not rechecked
+            self._offline_until = {}
+            # follower -> seconds of the last backoff delay
+            self._offline_delay = {}
+
             logger.info("Followers mode activated\n")
         else:
             # Get live information based on the provided user data
@@ -71,12 +134,12 @@ class TikTokRecorder:
             if self.room_id:
                 logger.info(
                     f"ROOM_ID:  {self.room_id}"
-                    + ("\n" if not self.tiktok.is_room_alive(self.room_id) else "")
+                    + ("\n" if not self.is_room_alive(self.room_id) else "")
                 )
 
-        # If proxy is provided, set up the HTTP client without the proxy
+        # If proxy is provided, keep using the HTTP client without the proxy
         if proxy:
-            self.tiktok = TikTokAPI(proxy=None, cookies=cookies)
+            self.tiktok.set_proxy(None)
 
     def run(self):
         """
@@ -91,57 +154,103 @@ class TikTokRecorder:
 
         if the mode is FOLLOWERS, it continuously checks the followers of
         the authenticated user. If any follower is live, it starts recording
-        their live stream in a separate process.
+        their live stream in a separate thread.
+
+        The first CTRL + C (or SIGTERM, e.g. from docker stop) stops every
+        wait and recording gracefully, a second one interrupts the program
+        as usual.
         """
-        if self.mode == Mode.MANUAL:
-            self.manual_mode()
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in STOP_SIGNALS:
+                previous_handlers[signum] = signal.signal(signum, self._handle_stop)
 
-        elif self.mode == Mode.AUTOMATIC:
-            self.automatic_mode()
+        try:
+            if self.mode == Mode.MANUAL:
+                self.manual_mode()
 
-        elif self.mode == Mode.FOLLOWERS:
-            self.followers_mode()
+            elif self.mode == Mode.AUTOMATIC:
+                self.automatic_mode()
+
+            elif self.mode == Mode.FOLLOWERS:
+                self.followers_mode()
+        finally:
+            if self._post_exec is not None:
+                logger.info("Waiting for pending uploads to finish...")
+                self._post_exec.shutdown(wait=True)
+
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+    def _handle_stop(self, signum, frame):
+        self._stop.set()
+        for stop_signum, default_handler in STOP_SIGNALS.items():
+            signal.signal(stop_signum, default_handler)
+
+    def _wait(self, seconds):
+        """
+        Waits up to the given seconds, returning True if the recorder was
+        stopped meanwhile. The wait is split in short slices because on
+        Windows CTRL + C cannot interrupt Event.wait, so the signal handler
+        would only run once the whole wait is over.
+        """
+        deadline = time.monotonic() + seconds
+        remaining = seconds
+        while remaining > 0:
+            if self._stop.wait(min(1, remaining)):
+                return True
+            remaining = deadline - time.monotonic()
+
+        return self._stop.is_set()
+
+    def is_room_alive(self, room_id):
+        """
+        Cached version of TikTokAPI.is_room_alive, to avoid checking the
+        same room several times in a row.
+        """
+        return self._alive_cache.get_or(
+            room_id,
+            TimeOut.ROOM_ALIVE_CACHE,
+            lambda: self.tiktok.is_room_alive(room_id),
+        )
 
     def manual_mode(self):
-        if not self.tiktok.is_room_alive(self.room_id):
+        if not self.is_room_alive(self.room_id):
             raise UserLiveError(f"@{self.user}: {TikTokError.USER_NOT_CURRENTLY_LIVE}")
 
         self.start_recording(self.user, self.room_id)
 
     def automatic_mode(self):
-        while True:
+        while not self._stop.is_set():
             try:
                 self.room_id = self.tiktok.get_room_id_from_user(self.user)
                 self.manual_mode()
 
             except UserLiveError as ex:
                 logger.info(ex)
-                logger.info(
-                    f"Waiting {self.automatic_interval} minutes before recheck\n"
-                )
-                time.sleep(self.automatic_interval * TimeOut.ONE_MINUTE)
+                logger.info(self._MSG_RECHECK, self.automatic_interval)
+                self._wait(self.automatic_interval * TimeOut.ONE_MINUTE)
 
             except LiveNotFound as ex:
-                logger.error(f"Live not found: {ex}")
-                logger.info(
-                    f"Waiting {self.automatic_interval} minutes before recheck\n"
-                )
-                time.sleep(self.automatic_interval * TimeOut.ONE_MINUTE)
+                logger.error("Live not found: %s", ex)
+                logger.info(self._MSG_RECHECK, self.automatic_interval)
+                self._wait(self.automatic_interval * TimeOut.ONE_MINUTE)
 
             except ConnectionError:
                 logger.error(Error.CONNECTION_CLOSED_AUTOMATIC)
-                time.sleep(TimeOut.CONNECTION_CLOSED * TimeOut.ONE_MINUTE)
+                self._wait(TimeOut.CONNECTION_CLOSED * TimeOut.ONE_MINUTE)
 
             except Exception as ex:
-                logger.error(f"Unexpected error: {ex}\n")
+                logger.error("Unexpected error: %s\n", ex)
 
     def followers_mode(self):
-        active_recordings = {}  # follower -> Process
+        active_recordings = {}  # follower -> Thread
 
-        while True:
+        while not self._stop.is_set():
             try:
                 followers = self.tiktok.get_followers_list(self.sec_uid)
 
+                pending = []
                 for follower in followers:
                     if follower in active_recordings:
                         if not active_recordings[follower].is_alive():
@@ -150,45 +259,108 @@ class TikTokRecorder:
                         else:
                             continue
 
-                    try:
-                        room_id = self.tiktok.get_room_id_from_user(follower)
+                    if time.monotonic() < self._offline_until.get(follower, 0):
+                        continue
+
+                    pending.append(follower)
+
+                with ThreadPoolExecutor(max_workers=MAX_PROBE_WORKERS) as executor:
+                    futures = {
+                        executor.submit(self._probe_follower, follower): follower
+                        for follower in pending
+                    }
+
+                    for future in as_completed(futures):
+                        if self._stop.is_set():
+                            executor.shutdown(cancel_futures=True)
+                            break
+
+                        follower = futures[future]
+                        try:
+                            room_id = future.result()
+                        except Exception as e:
+                            logger.error("Error while processing @%s: %s", follower, e)
+                            continue
 
-                        if not room_id or not self.tiktok.is_room_alive(room_id):
+                        if not room_id:
                             # logger.info(f"@{follower} is not live. Skipping...")
+                            self._back_off_follower(follower)
                             continue
 
+                        self._offline_until.pop(follower, None)
+                        self._offline_delay.pop(follower, None)
+
                         logger.info(f"@{follower} is live. Starting recording...")
 
-                        process = Process(
-                            target=self.start_recording, args=(follower, room_id)
+                        thread = threading.Thread(
+                            target=self._record_follower,
+                            args=(follower, room_id),
+                            daemon=True,
                         )
-                        process.start()
-                        active_recordings[follower] = process
-
-                        time.sleep(2.5)
+                        thread.start()
+                        active_recordings[follower] = thread
 
-                    except Exception as e:
-                        logger.error(f"Error while processing @{follower}: {e}")
-                        continue
+                        self._wait(0.2)
 
                 print()
                 delay = self.automatic_interval * TimeOut.ONE_MINUTE
                 logger.info(f"Waiting {delay} minutes for the next check...")
-                time.sleep(delay)
+                self._wait(delay)
 
             except UserLiveError as ex:
                 logger.info(ex)
-                logger.info(
-                    f"Waiting {self.automatic_interval} minutes before recheck\n"
-                )
-                time.sleep(self.automatic_interval * TimeOut.ONE_MINUTE)
+                logger.info(self._MSG_RECHECK, self.automatic_interval)
+                self._wait(self.automatic_interval * TimeOut.ONE_MINUTE)
 
             except ConnectionError:
                 logger.error(Error.CONNECTION_CLOSED_AUTOMATIC)
-                time.sleep(TimeOut.CONNECTION_CLOSED * TimeOut.ONE_MINUTE)
+                self._wait(TimeOut.CONNECTION_CLOSED * TimeOut.ONE_MINUTE)
 
             except Exception as ex:
-                logger.error(f"Unexpected error: {ex}\n")
+                logger.error("Unexpected error: %s\n", ex)
+
+        for thread in active_recordings.values():
+            thread.join()
+
+    def _probe_follower(self, follower):
+        """
+        Returns the room_id of the follower if they are live, None otherwise.
+        Runs on a worker thread of followers_mode.
+        """
+        room_id = self.tiktok.get_room_id_from_user(follower)
+
+        if not room_id or not self.is_room_alive(room_id):
+            return None
+
+        return room_id
+
+    def _record_follower(self, follower, room_id):
+        """
+        Records a follower's live on its own thread. The thread only feeds
+        the ffmpeg muxer, so there is no need for a whole Python process.
+        """
+        try:
+            self.start_recording(follower, room_id)
+        except Exception as ex:
+            logger.error("Error while recording @%s: %s", follower, ex)
+
+    def _back_off_follower(self, follower):
+        """
+        Skip an offline follower for a while, doubling the delay each time
+        it is found offline again, up to FOLLOWER_MAX_BACKOFF minutes.
+        The first delay is one interval, so the follower is rechecked on
+        the next scan. A random jitter, subtracted so the delay never grows
+        past its value, spreads the later rechecks over different scans.
+        """
+        interval = self.automatic_interval * TimeOut.ONE_MINUTE
+        max_delay = FOLLOWER_MAX_BACKOFF * TimeOut.ONE_MINUTE
+
+        delay = self._offline_delay.get(follower, 0) * 2
+        delay = min(max(delay, interval), max_delay)
+
+        self._offline_delay[follower] = delay
+        jitter = random.uniform(0, min(TimeOut.ONE_MINUTE, delay / 2))
+        self._offline_until[follower] = time.monotonic() + delay - jitter
 
     def start_recording(self, user, room_id):
         """
@@ -200,71 +372,105 @@ class TikTokRecorder:
 
         current_date = time.strftime("%Y.%m.%d_%H-%M-%S", time.localtime())
 
-        if isinstance(self.output, str) and self.output != "":
-            if not (self.output.endswith("/") or self.output.endswith("\\")):
-                if os.name == "nt":
-                    self.output = self.output + "\\"
-                else:
-                    self.output = self.output + "/"
-
-        output = f"{self.output if self.output else ''}TK_{user}_{current_date}_flv.mp4"
+        output = f"{self.output}TK_{user}_{current_date}.mp4"
 
         if self.duration:
             logger.info(f"Started recording for {self.duration} seconds ")
         else:
             logger.info("Started recording...")
 
-        buffer_size = 512 * 1024  # 512 KB buffer
-        buffer = bytearray()
-
         logger.info("[PRESS CTRL + C ONCE TO STOP]")
-        with open(output, "wb") as out_file:
+        # One deadline for the whole recording, reconnects don't extend it
+        deadline_ns = None
+        if self.duration:
+            deadline_ns = time.monotonic_ns() + int(self.duration * 1_000_000_000)
+
+        # ffmpeg is only started once the first chunk arrives, so a live
+        # that ends (or a stop) before any data leaves no empty file behind
+        muxer = None
+        out_file = None
+        try:
             stop_recording = False
-            while not stop_recording:
+            while not stop_recording and not self._stop.is_set():
                 try:
-                    if not self.tiktok.is_room_alive(room_id):
+                    if not self.is_room_alive(room_id):
                         logger.info("User is no longer live. Stopping recording.")
                         break
 
-                    start_time = time.time()
                     for chunk in self.tiktok.download_live_stream(live_url):
-                        buffer.extend(chunk)
-                        if len(buffer) >= buffer_size:
-                            out_file.write(buffer)
-                            buffer.clear()
+                        if out_file is None:
+                            muxer = VideoManagement.start_mp4_muxer(output)
+                            out_file = StreamWriter(muxer.stdin, output)
+
+                        out_file.write(chunk)
+
+                        if self._stop.is_set():
+                            logger.info("Recording stopped by user.")
+                            stop_recording = True
+                            break
 
-                        elapsed_time = time.time() - start_time
-                        if self.duration and elapsed_time >= self.duration:
+                        if deadline_ns and time.monotonic_ns() >= deadline_ns:
                             stop_recording = True
                             break
 
+                except StreamWriteError as ex:
+                    logger.error(ex)
+                    stop_recording = True
+
                 except ConnectionError:
                     if self.mode == Mode.AUTOMATIC:
                         logger.error(Error.CONNECTION_CLOSED_AUTOMATIC)
-                        time.sleep(TimeOut.CONNECTION_CLOSED * TimeOut.ONE_MINUTE)
+                        self._wait(TimeOut.CONNECTION_CLOSED * TimeOut.ONE_MINUTE)
 
                 except (RequestException, HTTPException):
-                    time.sleep(2)
+                    self._wait(2)
 
                 except KeyboardInterrupt:
                     logger.info("Recording stopped by user.")
                     stop_recording = True
 
                 except Exception as ex:
-                    logger.error(f"Unexpected error: {ex}\n")
+                    logger.error("Unexpected error: %s\n", ex)
                     stop_recording = True
 
                 finally:
-                    if buffer:
-                        out_file.write(buffer)
-                        buffer.clear()
-                    out_file.flush()
+                    # the stream ended or broke, recheck the room on retry
+                    self._alive_cache.invalidate(room_id)
+        finally:
+            if out_file is not None:
+                out_file.close()
+
+        if muxer is None:
+            logger.info("No data received from the live, nothing was recorded.\n")
+            return
+
+        VideoManagement.wait_mp4_muxer(muxer, output)
+        if not os.path.exists(output):
+            logger.error("Recording failed, %s was not created.\n", output)
+            return
 
         logger.info(f"Recording finished: {output}\n")
-        VideoManagement.convert_flv_to_mp4(output)
 
         if self.use_telegram:
-            Telegram().upload(output.replace("_flv.mp4", ".mp4"))
+            self._submit_post_processing(output)
+
+    def _submit_post_processing(self, output):
+        """
+        Runs the upload in a separate process, so the recorder can
+        go back to checking for lives right away.
+        """
+        with self._post_exec_lock:
+            if self._post_exec is None:
+                # spawn instead of fork: the recorder has threads running
+                # and there is no need to copy its memory for an upload
+                self._post_exec = ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_ignore_sigint,
+                )
+
+        future = self._post_exec.submit(_upload_recording, output)
+        future.add_done_callback(partial(_log_upload_error, output))
 
     def check_country_blacklisted(self):
         is_blacklisted = self.tiktok.is_country_blacklisted()
@@ -1,4 +1,6 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from utils.enums import StatusCode
 from utils.logger_manager import logger
@@ -34,6 +36,19 @@ class HttpClient:
     def configure_session(self) -> None:
         self.req_stream = requests.Session()
 
+        # Only covers the requests session: the live stream, plus every API
+        # call on Termux. Elsewhere the API calls (including the follower
+        # probes) go through the curl_cffi session, which has its own pool.
+        # The pool keeps the requests defaults; Retry-After is ignored so a
+        # 429 or 503 does not stall the stream for as long as the server asks.
+        adapter = HTTPAdapter(
+            max_retries=Retry(
+                total=3, backoff_factor=0.3, respect_retry_after_status=False
+            ),
+        )
+        self.req_stream.mount("https://", adapter)
+        self.req_stream.mount("http://", adapter)
+
         if is_termux():
             self.req = self.req_stream
         else:
@@ -62,3 +77,10 @@ class HttpClient:
         if response.status_code == StatusCode.OK:
             self.req.proxies.update(proxies)
             logger.info("Proxy set up successfully")
+
+    def set_proxy(self, proxy) -> None:
+        """
+        Replaces the proxy of the session without recreating it.
+        """
+        self.proxy = proxy
+        self.req.proxies = {"http": proxy, "https": proxy} if proxy else {}
@@ -25,6 +25,12 @@ class LiveNotFound(TikTokRecorderError):
     pass
 
 
+class StreamWriteError(TikTokRecorderError):
+    """Raised when the recording can no longer be written."""
+
+    pass
+
+
 class ArgsParseError(TikTokRecorderError):
     """Raised for argument parsing errors."""
 
@@ -19,6 +19,9 @@ class TimeOut(IntEnum):
     ONE_MINUTE = 60
     AUTOMATIC_MODE = 5
     CONNECTION_CLOSED = 2
+    STREAM_READ = 30  # seconds without data before reconnecting
+    ROOM_ALIVE_CACHE = 15  # seconds a room liveness check is reused
+    MUXER_EXIT = 10  # seconds ffmpeg has to finish the file
 
 
 class StatusCode(IntEnum):
@@ -0,0 +1,138 @@
+import os
+import queue
+import threading
+
+from utils.custom_exceptions import StreamWriteError
+from utils.logger_manager import logger
+
+SLAB_SIZE = 512 * 1024  # 512 KB per slab
+SLAB_COUNT = 8
+
+_CLOSE = object()
+
+
+class StreamWriter:
+    """
+    Writes recorded data to a binary file object (a file or a pipe) on a
+    background thread, so the recorder can keep reading from the network
+    while the previous buffer is being written.
+
+    Data is collected into a fixed pool of pre-allocated slabs which are
+    recycled once written, so no buffer is allocated while recording.
+    """
+
+    def __init__(self, sink, name, slab_size=SLAB_SIZE, slab_count=SLAB_COUNT):
+        self.name = name
+        self._file = sink
+        self._queue = queue.Queue()
+        self._error = None
+
+        self._pool = queue.Queue()
+        for _ in range(slab_count):
+            self._pool.put(bytearray(slab_size))
+
+        self._slab = None
+        self._view = None
+        self._offset = 0
+
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        item = self._queue.get()
+        while item is not _CLOSE:
+            # Gather every slab already queued, to write them in one call
+            batch = [item]
+            item = self._next_queued()
+            while item is not None and item is not _CLOSE:
+                batch.append(item)
+                item = self._next_queued()
+
+            self._write_batch(batch)
+
+            if item is None:
+                item = self._queue.get()
+
+    def _next_queued(self):
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _write_batch(self, batch):
+        views = [memoryview(slab)[:length] for slab, length in batch]
+        try:
+            if self._error is not None:
+                # the sink is gone (e.g. ffmpeg exited), drop the data
+                return
+
+            if hasattr(os, "writev"):
+                fd = self._file.fileno()
+                while views:
+                    written = os.writev(fd, views)
+                    while views and written >= len(views[0]):
+                        written -= len(views.pop(0))
+                    if views:
+                        views[0] = views[0][written:]
+            else:
+                for view in views:
+                    self._file.write(view)
+        except OSError as ex:
+            logger.error("Error while writing %s: %s", self.name, ex)
+            self._error = ex
+        finally:
+            for slab, _ in batch:
+                self._pool.put(slab)
+
+    def _submit(self):
+        if self._offset:
+            self._queue.put((self._slab, self._offset))
+        else:
+            self._pool.put(self._slab)
+
+        self._slab = None
+        self._view = None
+        self._offset = 0
+
+    def write(self, data):
+        """
+        Copy data into the current slab, queueing it once it is full.
+        Blocks while every slab is still waiting to be written.
+        Raises StreamWriteError once a write to the sink has failed.
+        """
+        if self._error is not None:
+            raise StreamWriteError(f"Unable to write {self.name}: {self._error}")
+
+        data = memoryview(data)
+        while data:
+            if self._slab is None:
+                self._slab = self._pool.get()
+                self._view = memoryview(self._slab)
+
+            n = min(len(data), len(self._slab) - self._offset)
+            self._view[self._offset : self._offset + n] = data[:n]
+            self._offset += n
+            data = data[n:]
+
+            if self._offset == len(self._slab):
+                self._submit()
+
+    def close(self):
+        """
+        Wait for the pending slabs to be written and close the file.
+        """
+        if self._slab is not None:
+            self._submit()
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+        try:
+            self._file.close()
+        except OSError:
+            pass  # already reported by the writer thread
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
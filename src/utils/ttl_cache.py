@@ -0,0 +1,47 @@
+import threading
+import time
+
+
+class TTLCache:
+    """
+    Minimal thread-safe cache whose entries expire after a given number of
+    seconds.
+    """
+
+    def __init__(self):
+        self._entries = {}  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get_or(self, key, ttl, fn):
+        """
+        Return the cached value for key, calling fn to refresh it if it is
+        missing or expired. Expired entries are dropped when the cache is
+        refreshed, so it does not grow with keys that are no longer used.
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry[1]:
+                return entry[0]
+
+        value = fn()
+
+        with self._lock:
+            self._prune(now)
+            self._entries[key] = (value, now + ttl)
+        return value
+
+    def _prune(self, now):
+        expired = [
+            key for key, (_, expires_at) in self._entries.items() if now >= expires_at
+        ]
+        for key in expired:
+            del self._entries[key]
+
+    def invalidate(self, key):
+        """
+        Drop the cached value for key, if any.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
@@ -1,50 +1,54 @@
 import os
-import time
+import subprocess
 
 import ffmpeg
 
+from utils.enums import TimeOut
 from utils.logger_manager import logger
 
 
 class VideoManagement:
     @staticmethod
-    def wait_for_file_release(file, timeout=10):
+    def start_mp4_muxer(file):
         """
-        Wait until the file is released (not locked anymore) or timeout is reached.
+        Start an ffmpeg process that remuxes the flv stream written to its
+        stdin into a fragmented mp4, so no conversion is needed afterwards.
+
+        ffmpeg runs in its own session (process group on Windows) so that
+        CTRL + C only reaches the recorder, which then closes stdin to let
+        ffmpeg finish the file.
         """
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            try:
-                with open(file, "ab"):
-                    return True
-            except PermissionError:
-                time.sleep(0.5)
-        return False
+        cmd = (
+            ffmpeg.input("pipe:", f="flv")
+            .output(file, c="copy", movflags="frag_keyframe+empty_moov")
+            .global_args("-loglevel", "error")
+            .overwrite_output()
+            .compile()
+        )
+
+        if os.name == "nt":
+            return subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                creationflags=subprocess.CREATE_NEW_PROCESS_GROUP,
+            )
+
+        return subprocess.Popen(cmd, stdin=subprocess.PIPE, start_new_session=True)
 
     @staticmethod
-    def convert_flv_to_mp4(file):
+    def wait_mp4_muxer(process, file):
         """
-        Convert the video from flv format to mp4 format
+        Wait for the ffmpeg muxer to finish the file once its stdin is closed,
+        killing it if it does not exit in time.
         """
-        logger.info("Converting {} to MP4 format...".format(file))
-
-        if not VideoManagement.wait_for_file_release(file):
-            logger.error(
-                f"File {file} is still locked after waiting. Skipping conversion."
-            )
-            return
-
         try:
-            ffmpeg.input(file).output(
-                file.replace("_flv.mp4", ".mp4"),
-                c="copy",
-                y="-y",
-            ).run(quiet=True)
-        except ffmpeg.Error as e:
+            return_code = process.wait(timeout=TimeOut.MUXER_EXIT)
+        except subprocess.TimeoutExpired:
+            logger.error("ffmpeg did not finish %s in time, killing it.", file)
+            process.kill()
+            return_code = process.wait()
+
+        if return_code != 0:
             logger.error(
-                f"ffmpeg error: {e.stderr.decode() if hasattr(e, 'stderr') else str(e)}"
+                "ffmpeg exited with code %s while saving %s", return_code, file
             )
-
-        os.remove(file)
-
-        logger.info("Finished converting {}\n".format(file))